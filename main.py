@@ -1,53 +1,254 @@
 # Import Python libraries
 import os
-import json
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 
 # Import third-party libraries
 import pandas as pd
 import numpy as np
+import orjson
 from fastmcp import FastMCP
 from rapidfuzz import fuzz, process, utils
 
 app = FastMCP("outgassing-mcp-server")
 
-# Set up global data cache
+# Total length of tool output strings kept for repeat queries - a single output can take up to 1/8 of this
+OUTPUT_CACHE_MAX_CHARS = 32 * 1024 * 1024
+
+# Largest fuzzy match limit whose matches are cached - larger limits are rare and would hold most of the table per entry
+FUZZY_CACHE_MAX_LIMIT = 100
+
+@dataclass(frozen=True)
+class _OutgassingData:
+    """Loaded outgassing data and the lookup structures derived from it
+    """
+    frame: pd.DataFrame
+    sample_material_choices_norm: list
+    sample_material: np.ndarray
+    ids: np.ndarray
+    adjusted_tml: np.ndarray
+    adjusted_tml_order: np.ndarray
+    cvcm: np.ndarray
+    usage_codes: np.ndarray
+    usage_categories_lower: np.ndarray
+    application_rows_json: np.ndarray
+    id_to_pos: dict
+    applications_json: str
+
+# Set up global data cache - only ever assigned fully built, so tools never see partially loaded data
 outgassing_data = None
 
-def load_outgassing_data():
+# Guard against concurrent first tool calls loading the data twice
+_load_lock = asyncio.Lock()
+
+async def load_outgassing_data():
+    """Load outgassing data to global cache once, off the event loop
+    """
+    # Return cached data if already loaded
+    if outgassing_data is not None:
+        return
+    
+    async with _load_lock:
+        # Another caller may have loaded the data while waiting for the lock
+        if outgassing_data is None:
+            await asyncio.to_thread(_load_outgassing_data_sync)
+    return
+
+def _load_outgassing_data_sync():
     """Load outgassing data from local CSV file to global cache
     """
     # Access global data cache
     global outgassing_data
     
-    # Return cached data if already loaded
-    if outgassing_data is not None:
-        return
     # Load data from CSV file
-    else:
-        outgassing_data = pd.read_csv("data/Outgassing_Db_rows.csv")
+    frame = pd.read_csv("data/Outgassing_Db_rows.csv")
+    
+    # Calculate adjusted TML
+    calculate_adjusted_tml(frame)
+    
+    # Normalise fuzzy match choices once rather than on every query - missing names become empty strings that never match
+    sample_material_choices_norm = [utils.default_process(choice) for choice in frame['Sample Material'].fillna('').astype(str).tolist()]
+    
+    # Extract columns returned by queries as numpy arrays once so queries gather rows without touching pandas
+    sample_material = frame['Sample Material'].to_numpy()
+    ids = frame['ID'].to_numpy()
     
-        # Calculate adjusted TML
-        calculate_adjusted_tml()
-        return 
+    # Extract columns used by query filters as numpy arrays once rather than on every query
+    # float32 holds the two decimal place percentages exactly enough and halves the memory scanned per comparison
+    adjusted_tml = frame['adjusted_tml'].to_numpy(dtype=np.float32)
+    cvcm = frame['CVCM'].to_numpy(dtype=np.float32)
+    
+    # Row positions sorted by adjusted TML (ties in database order) so filtered results come out already sorted
+    adjusted_tml_order = np.argsort(frame['adjusted_tml'].to_numpy(), kind='stable')
+    
+    # Dictionary-encode Material Usage so application searches scan the unique usages rather than every row
+    usage = pd.Categorical(frame['Material Usage'])
+    usage_codes = usage.codes
+    usage_categories_lower = usage.categories.str.lower().to_numpy(dtype=str)
+    
+    # Serialise each row's query_application result once - rows returned there always pass both limits
+    application_rows_json = np.array([
+        orjson.dumps({
+            "sample_material": name,
+            "id": material_id,
+            "tml_pass": True,
+            "cvcm_pass": True
+        })
+        for name, material_id in zip(sample_material.tolist(), ids.tolist())
+    ], dtype=object)
+    
+    # Map material IDs to row positions, keeping the first row for any duplicated ID
+    id_to_pos = {}
+    for pos, material_id in enumerate(frame['ID'].tolist()):
+        id_to_pos.setdefault(material_id, pos)
+    
+    # Serialise the static list of unique applications once
+    unique_apps = frame['Material Usage'].dropna().unique().tolist()
+    applications_json = _to_json({
+        "total_applications": len(unique_apps),
+        "applications": unique_apps
+    })
+    
+    # Invalidate matches computed against previously loaded data
+    _fuzzy_extract.cache_clear()
+    _usage_mask.cache_clear()
+    _output_cache.clear()
+    
+    # Publish everything with a single assignment - the unlocked check in load_outgassing_data relies on this
+    outgassing_data = _OutgassingData(
+        frame=frame,
+        sample_material_choices_norm=sample_material_choices_norm,
+        sample_material=sample_material,
+        ids=ids,
+        adjusted_tml=adjusted_tml,
+        adjusted_tml_order=adjusted_tml_order,
+        cvcm=cvcm,
+        usage_codes=usage_codes,
+        usage_categories_lower=usage_categories_lower,
+        application_rows_json=application_rows_json,
+        id_to_pos=id_to_pos,
+        applications_json=applications_json
+    )
+    return 
 
-def calculate_adjusted_tml():
+def _to_json(obj) -> str:
+    """Serialise tool output to a compact JSON string, accepting numpy scalars and arrays.
     """
-    Calculate adjusted TML for compliance: (TML - WVR) if WVR present, else TML.
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+class _OutputCache:
+    """Least recently used cache of tool output strings, bounded by their total length rather than entry count
     """
-    global outgassing_data
+    def __init__(self, max_chars: int):
+        self._max_chars = max_chars
+        self._chars = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return cached output for a key, or None if not cached
+        """
+        with self._lock:
+            output = self._entries.get(key)
+            if output is not None:
+                self._entries.move_to_end(key)
+            return output
     
-    # Vectorized calculation of adjusted TML
-    conditions = [~pd.isna(outgassing_data['WVR'])]
-    choices = [outgassing_data['TML'] - outgassing_data['WVR']]
-    default = outgassing_data['TML']
+    def put(self, key, output: str):
+        """Cache output for a key, evicting the least recently used outputs to stay within the size bound
+        """
+        # Skip very large outputs so one query cannot flush everything else
+        if len(output) > self._max_chars // 8:
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = output
+            self._chars += len(output)
+            while self._chars > self._max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+    
+    def clear(self):
+        """Remove all cached output
+        """
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+
+# Output of query tools for repeated parameter tuples
+_output_cache = _OutputCache(OUTPUT_CACHE_MAX_CHARS)
+
+def calculate_adjusted_tml(data: pd.DataFrame):
+    """
+    Calculate adjusted TML for compliance: (TML - WVR) if WVR present, else TML.
+    """
+    # Vectorized calculation of adjusted TML - missing WVR subtracts nothing
+    tml = data['TML'].to_numpy()
+    wvr = data['WVR'].to_numpy()
     
     # Add adjusted_tml column
-    outgassing_data['adjusted_tml'] = np.select(conditions, choices, default=default)
+    data['adjusted_tml'] = tml - np.nan_to_num(wvr, nan=0.0)
     return
 
+def _fuzzy_match(material: str, limit: int) -> tuple:
+    """Fuzzy match a normalised material name against the Sample Material column.
+    
+    Scores are computed in a single batched RapidFuzz call across all cores.
+    
+    Args:
+        material: Material name already normalised with utils.default_process
+        limit: Maximum number of matches to return
+    Returns:
+        Tuple of (index, score) matches, best match first
+    """
+    scores = process.cdist([material], outgassing_data.sample_material_choices_norm, scorer=fuzz.WRatio, processor=None, dtype=np.float64, workers=-1)[0]
+    
+    # Select the top matches without sorting every score - ties at the cut-off keep the earliest rows like process.extract
+    k = min(limit, len(scores))
+    if k <= 0:
+        return ()
+    kth_score = -np.partition(-scores, k - 1)[k - 1]
+    better_idxs = np.flatnonzero(scores > kth_score)
+    tied_idxs = np.flatnonzero(scores == kth_score)[:k - len(better_idxs)]
+    top_idxs = np.concatenate((better_idxs, tied_idxs))
+    
+    # Order the selected matches by score, then by row position
+    top_idxs = top_idxs[np.lexsort((top_idxs, -scores[top_idxs]))]
+    return tuple(zip(top_idxs.tolist(), scores[top_idxs].tolist()))
+
+@lru_cache(maxsize=1024)
+def _fuzzy_extract(material: str, limit: int) -> tuple:
+    """Cached _fuzzy_match() so repeated queries skip the scan - only used for limits up to FUZZY_CACHE_MAX_LIMIT
+    """
+    return _fuzzy_match(material, limit)
+
+@lru_cache(maxsize=256)
+def _usage_mask(application: str) -> np.ndarray:
+    """Find rows whose Material Usage contains an application as a literal substring.
+    
+    The substring test runs over the unique usages only and is mapped back to rows through their category codes.
+    Masks are cached so repeated application queries skip the string scan.
+    
+    Args:
+        application: Lowercase application/usage type to search for
+    Returns:
+        Read-only boolean array with one entry per row
+    """
+    category_mask = np.char.find(outgassing_data.usage_categories_lower, application) >= 0
+    
+    # Append a False entry for code -1 so rows with no usage never match
+    mask = np.append(category_mask, False)[outgassing_data.usage_codes]
+    mask.flags.writeable = False
+    return mask
+
 @app.tool()
-def query_materials(material: str, max_tml: float = 1.0, max_cvcm: float = 0.1, 
-                    limit: int = 10) -> str:
+async def query_materials(material: str, max_tml: float = 1.0, max_cvcm: float = 0.1, 
+                          limit: int = 10) -> str:
     """Query materials from NASA outgassing database matching a material name and whether they meet TML and CVCM limits.
     
     Args:
@@ -59,47 +260,61 @@ def query_materials(material: str, max_tml: float = 1.0, max_cvcm: float = 0.1,
         JSON string with materials matched in the database, sorted by match score (best first, 100 being exact match, less than 82 being a low quality match).
     """
     # Load outgassing data
-    load_outgassing_data()
-    
-    # Fuzzy search on Sample Material column - get all materials with scores
-    all_materials = outgassing_data['Sample Material'].to_list()
-    matched_materials = process.extract(material, all_materials, scorer=fuzz.WRatio, processor=utils.default_process, limit=limit)
-    
-    # Create results dataframe with only matched materials
-    matched_names = [match[0] for match in matched_materials]
-    results = outgassing_data[outgassing_data['Sample Material'].isin(matched_names)].copy()
-    
-    # Add match scores to results
-    score_map = {match[0]: match[1] for match in matched_materials}
-    results['match_score'] = results['Sample Material'].map(score_map)
-    
-    # Create TML and CVCM pass/fail columns
-    results['tml_pass'] = results['adjusted_tml'] <= max_tml
-    results['cvcm_pass'] = results['CVCM'] <= max_cvcm
-    
-    # Sort results by match score descending (best matches first)
-    results = results.sort_values(by='match_score', ascending=False)
-
-    # Convert to list of dictionaries for JSON serialization
-    materials_list = []
-    for _, row in results.iterrows():
-        materials_list.append({
-            "sample_material": row['Sample Material'],
-            "id": row['ID'],
-            "match_score": int(row['match_score']),
-            "tml_pass": bool(row['tml_pass']),
-            "cvcm_pass": bool(row['cvcm_pass'])
-        })
+    await load_outgassing_data()
+    
+    # Return cached output for exact repeat queries
+    key = ("query_materials", material, max_tml, max_cvcm, limit)
+    output = _output_cache.get(key)
+    if output is None:
+        # Run the fuzzy search in a worker thread so concurrent tool calls are not blocked
+        output = await asyncio.to_thread(_query_materials, material, max_tml, max_cvcm, limit)
+        _output_cache.put(key, output)
+    return output
+
+def _query_materials(material: str, max_tml: float, max_cvcm: float, limit: int) -> str:
+    """Fuzzy match a material name and check matches against TML and CVCM limits, see query_materials().
+    """
+    # Fuzzy search on Sample Material column - normalise first so case/whitespace variants share cache entries
+    # Matches for very large limits are computed without caching to keep the match cache small
+    material_norm = utils.default_process(material)
+    if limit <= FUZZY_CACHE_MAX_LIMIT:
+        matched_materials = _fuzzy_extract(material_norm, limit)
+    else:
+        matched_materials = _fuzzy_match(material_norm, limit)
+    
+    # Get row positions and match scores (as whole numbers) of matched materials - already best first from the top-k selection
+    idxs = np.fromiter((match[0] for match in matched_materials), dtype=np.int64, count=len(matched_materials))
+    match_scores = np.fromiter((match[1] for match in matched_materials), dtype=np.float64, count=len(matched_materials)).astype(np.int32)
+    
+    # Create TML and CVCM pass/fail arrays
+    tml_pass = outgassing_data.adjusted_tml[idxs] <= max_tml
+    cvcm_pass = outgassing_data.cvcm[idxs] <= max_cvcm
+    
+    # Gather matched material names and IDs by row position
+    names = outgassing_data.sample_material[idxs]
+    ids = outgassing_data.ids[idxs]
+
+    # Convert to list of dictionaries for JSON serialization - tolist() converts each column to native Python types in one pass
+    materials_list = [
+        {
+            "sample_material": name,
+            "id": material_id,
+            "match_score": score,
+            "tml_pass": tml_ok,
+            "cvcm_pass": cvcm_ok
+        }
+        for name, material_id, score, tml_ok, cvcm_ok in zip(names.tolist(), ids.tolist(), match_scores.tolist(), tml_pass.tolist(), cvcm_pass.tolist())
+    ]
         
     # Return JSON
-    return json.dumps({
+    return _to_json({
             "query": material,
             "limits": {"max_tml": max_tml, "max_cvcm": max_cvcm},
             "results": materials_list
         })
     
 @app.tool()
-def get_material(material_id: str) -> str:
+async def get_material(material_id: str) -> str:
     """Get material details by unique ID from the outgassing database.
     
     Integration pattern: Call query_materials() or query_application() to find material IDs before invoking this function.
@@ -109,35 +324,31 @@ def get_material(material_id: str) -> str:
     Returns:
         JSON string with material details or error message if ID not found
     """
-    load_outgassing_data()
+    await load_outgassing_data()
     
-    material_row = outgassing_data[outgassing_data['ID'] == material_id]
-    if material_row.empty:
-        return json.dumps({
+    pos = outgassing_data.id_to_pos.get(material_id)
+    if pos is None:
+        return _to_json({
             "error": f"Material with ID '{material_id}' not found in the database."
         })
         
     # Convert the material row to a dictionary and then to JSON
-    material_dict = material_row.iloc[0].to_dict()
-    return json.dumps(material_dict)
+    material_dict = outgassing_data.frame.iloc[pos].to_dict()
+    return _to_json(material_dict)
     
 @app.tool()
-def get_applications() -> str:
+async def get_applications() -> str:
     """Get a list of unique material application/usage types from the outgassing database.
     
     Returns:
         JSON string with list of unique material application/usage types
     """
-    load_outgassing_data()
+    await load_outgassing_data()
     
-    unique_apps = outgassing_data['Material Usage'].dropna().unique().tolist()
-    return json.dumps({
-        "total_applications": len(unique_apps),
-        "applications": unique_apps
-    })
+    return outgassing_data.applications_json
 
 @app.tool()
-def query_application(application: str, max_tml: float = 1.0, max_cvcm: float = 0.1) -> str:
+async def query_application(application: str, max_tml: float = 1.0, max_cvcm: float = 0.1) -> str:
     """Query materials by application/usage meeting specified TML and CVCM limits.
     
     Integration pattern: Call get_applications() to retrieve available application/usage types before invoking this function.
@@ -150,41 +361,39 @@ def query_application(application: str, max_tml: float = 1.0, max_cvcm: float =
     Returns:
         JSON string with materials meeting application and outgassing criteria sorted by adjusted TML with lowest values first.
     """
-    load_outgassing_data()
-    
-    # Create results dataframe with only materials matching the application
-    results = outgassing_data[outgassing_data['Material Usage'].str.contains(application, case=False, na=False)].copy()
-    
-    # Create TML and CVCM pass/fail columns
-    results['tml_pass'] = results['adjusted_tml'] <= max_tml
-    results['cvcm_pass'] = results['CVCM'] <= max_cvcm
+    await load_outgassing_data()
     
-    # Remove materials that do not meet criteria
-    results = results[(results['tml_pass']) & (results['cvcm_pass'])].copy()
+    # Return cached output for exact repeat queries
+    key = ("query_application", application, max_tml, max_cvcm)
+    output = _output_cache.get(key)
+    if output is None:
+        # Run the application search in a worker thread so concurrent tool calls are not blocked
+        output = await asyncio.to_thread(_query_application, application, max_tml, max_cvcm)
+        _output_cache.put(key, output)
+    return output
+
+def _query_application(application: str, max_tml: float, max_cvcm: float) -> str:
+    """Find materials for an application that meet TML and CVCM limits, see query_application().
+    """
+    # Find materials matching the application (case-insensitive substring) that meet both criteria
+    mask = _usage_mask(application.lower()) & (outgassing_data.adjusted_tml <= max_tml) & (outgassing_data.cvcm <= max_cvcm)
     
-    # Sort results by adjusted TML ascending 
-    results = results.sort_values(by='adjusted_tml', ascending=True)
+    # Take matches in adjusted TML ascending order 
+    idxs = outgassing_data.adjusted_tml_order[mask[outgassing_data.adjusted_tml_order]]
     
-    if results.empty:
-        return json.dumps({
+    if len(idxs) == 0:
+        return _to_json({
             "error": f"No materials found for application '{application}' meeting the specified criteria."
         })
     
-    # Convert to list of dictionaries for JSON serialization
-    materials_list = []
-    for _, row in results.iterrows():
-        materials_list.append({
-            "sample_material": row['Sample Material'],
-            "id": row['ID'],
-            "tml_pass": bool(row['tml_pass']),
-            "cvcm_pass": bool(row['cvcm_pass'])
-        })
+    # Join the pre-serialised rows into the results array without building intermediate dictionaries
+    materials_json = orjson.Fragment(b"[" + b",".join(outgassing_data.application_rows_json[idxs].tolist()) + b"]")
         
     # Return JSON
-    return json.dumps({
+    return _to_json({
             "query": application,
             "limits": {"max_tml": max_tml, "max_cvcm": max_cvcm},
-            "results": materials_list
+            "results": materials_json
         })
 
 if __name__ == "__main__":